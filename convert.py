@@ -0,0 +1,44 @@
+import os
+import pandas as pd
+
+CSV_PATH = "ResaleflatpricesbasedonregistrationdatefromJan2017onwards.csv"
+PARQUET_PATH = "resale.parquet"
+
+# -----------------------------
+# Parse CSV & Derive Columns
+# -----------------------------
+def parse_csv(path=CSV_PATH):
+    df = pd.read_csv(path, engine="pyarrow")  # multithreaded Arrow CSV reader
+    df["month"] = pd.to_datetime(df["month"])
+    df["remaining_lease_years"] = df["remaining_lease"].str.extract(r'(\d+)').astype(int)
+    df["storey_floor"] = df["storey_range"].str.extract(r'(\d+)').astype(int)
+    df["price_per_sqm"] = df["resale_price"] / df["floor_area_sqm"]
+    return df
+
+# -----------------------------
+# Write Parquet
+# -----------------------------
+def write_parquet(df, parquet_path=PARQUET_PATH):
+    # Write to a temp file and swap it in, so a failed write never leaves a truncated parquet behind
+    tmp_path = parquet_path + ".tmp"
+    try:
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd", index=False)
+        os.replace(tmp_path, parquet_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def is_stale(csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    # A parquet shipped without its CSV is used as-is
+    if not os.path.exists(parquet_path):
+        return True
+    return os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(parquet_path)
+
+def convert(csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    df = parse_csv(csv_path)
+    write_parquet(df, parquet_path)
+    return df
+
+if __name__ == "__main__":
+    convert()
+    print(f"Wrote {PARQUET_PATH}")
@@ -1,22 +1,57 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 from datetime import datetime
 import textwrap
+from convert import PARQUET_PATH, is_stale, parse_csv, write_parquet
 
 # -----------------------------
 # Load Data
 # -----------------------------
-@st.cache_data
+# One shared, read-only frame for all sessions; resource caching hands it out by reference
+# instead of unpickling a copy per rerun. resale.parquet is the on-disk cache.
+@st.cache_resource
 def load_data():
-    df = pd.read_csv("ResaleflatpricesbasedonregistrationdatefromJan2017onwards.csv")
-    df["month"] = pd.to_datetime(df["month"])
-    df["remaining_lease_years"] = df["remaining_lease"].str.extract(r'(\d+)').astype(int)
-    df["storey_floor"] = df["storey_range"].str.extract(r'(\d+)').astype(int)
-    df["price_per_sqm"] = df["resale_price"] / df["floor_area_sqm"]
-    return df
+    # Derived columns are baked into the parquet by convert.py; rebuild it when missing or older than the CSV
+    if is_stale():
+        df = parse_csv()
+        try:
+            write_parquet(df)
+        except OSError:
+            pass  # e.g. read-only deploy directory: the parquet is only a cache, serve the parsed CSV
+    else:
+        df = pd.read_parquet(PARQUET_PATH, engine="pyarrow")
+    # Categoricals so filter comparisons run on integer codes (flat_model keeps its display case)
+    for c in ("town","flat_type","street_name"):
+        df[c] = df[c].str.upper().astype("category")
+    df["flat_model"] = df["flat_model"].astype("category")
+    # Narrow numeric dtypes: every filter mask and groupby touches fewer bytes
+    df["storey_floor"] = df["storey_floor"].astype(np.int16)
+    df["remaining_lease_years"] = df["remaining_lease_years"].astype(np.int16)
+    # floor_area_sqm, resale_price and price_per_sqm stay float64: the first two are shown
+    # unformatted in chart hovers and the top-20 table, where float32 prints 60.29999923706055,
+    # and the last feeds the value score, where float32 shifts a handful of scores by a point
+    # Sidebar choices and slider bounds, so reruns don't rescan the full columns
+    options = {
+        "towns": sorted(df["town"].dropna().unique().tolist()),
+        "flat_types": sorted(df["flat_type"].dropna().unique().tolist()),
+        "flat_models": sorted(df["flat_model"].dropna().unique().tolist()),
+        "storey": (int(df["storey_floor"].min()), int(df["storey_floor"].max())),
+        "floor_area": (int(df["floor_area_sqm"].min()), int(df["floor_area_sqm"].max())),
+        "lease": (int(df["remaining_lease_years"].min()), int(df["remaining_lease_years"].max())),
+        "latest_month": df["month"].max(),
+    }
+    return df, options
+
+# Row positions per (town, flat_type) so the two most selective filters become a single take
+@st.cache_resource
+def build_town_index(_df):
+    return _df.groupby(["town","flat_type"], observed=True).indices
 
-df = load_data()
+df, options = load_data()
+town_index = build_town_index(df)
 
 # -----------------------------
 # Price Formatting
@@ -41,101 +76,163 @@ default_flat_type = "4 ROOM"
 default_flat_models = ["Improved","DBSS","Standard","S1","S2","Model A","Model A2","Simplified"]
 
 # Town
+towns = options["towns"]
 town = st.sidebar.selectbox(
     "Town",
-    sorted(df["town"].dropna().unique()),
-    index=sorted(df["town"].dropna().unique()).index(default_town)
+    towns,
+    index=towns.index(default_town)
 )
 
 # Flat Type
+flat_types = options["flat_types"]
 flat_type = st.sidebar.selectbox(
     "Flat Type",
-    sorted(df["flat_type"].dropna().unique()),
-    index=sorted(df["flat_type"].dropna().unique()).index(default_flat_type)
+    flat_types,
+    index=flat_types.index(default_flat_type)
 )
 
-# Flat Model Tiles
+# Flat Model
 st.sidebar.markdown("**Flat Model**")
-flat_model_options = sorted(df["flat_model"].dropna().unique())
+flat_model_options = options["flat_models"]
 col1, col2 = st.sidebar.columns(2)
 select_all = col1.button("Select All")
 deselect_all = col2.button("Deselect All")
 
-if "selected_flat_models" not in st.session_state:
-    st.session_state.selected_flat_models = [m for m in flat_model_options if m in default_flat_models]
+if "flat_models" not in st.session_state:
+    st.session_state.flat_models = [m for m in flat_model_options if m in default_flat_models]
 
-if select_all: st.session_state.selected_flat_models = flat_model_options.copy()
-if deselect_all: st.session_state.selected_flat_models = []
+if select_all: st.session_state.flat_models = flat_model_options.copy()
+if deselect_all: st.session_state.flat_models = []
 
-num_cols = 2
-cols = st.sidebar.columns(num_cols)
-selected_flat_models = []
-for i, model in enumerate(flat_model_options):
-    col = cols[i % num_cols]
-    checked = model in st.session_state.selected_flat_models
-    if col.checkbox(model, value=checked):
-        selected_flat_models.append(model)
-st.session_state.selected_flat_models = selected_flat_models
+selected_flat_models = st.sidebar.multiselect(
+    "Flat Model",
+    flat_model_options,
+    key="flat_models",
+    label_visibility="collapsed"
+)
 
 # Storey, Floor Area, Remaining Lease, Month Sold sliders
-storey_range = st.sidebar.slider("Storey Range", int(df["storey_floor"].min()), int(df["storey_floor"].max()), (int(df["storey_floor"].min()), int(df["storey_floor"].max())))
-floor_area_range = st.sidebar.slider("Floor Area (sqm)", int(df["floor_area_sqm"].min()), int(df["floor_area_sqm"].max()), (int(df["floor_area_sqm"].min()), int(df["floor_area_sqm"].max())))
-lease_range = st.sidebar.slider("Remaining Lease (Years)", int(df["remaining_lease_years"].min()), int(df["remaining_lease_years"].max()), (int(df["remaining_lease_years"].min()), int(df["remaining_lease_years"].max())))
-latest_month = df["month"].max()
+storey_range = st.sidebar.slider("Storey Range", *options["storey"], options["storey"])
+floor_area_range = st.sidebar.slider("Floor Area (sqm)", *options["floor_area"], options["floor_area"])
+lease_range = st.sidebar.slider("Remaining Lease (Years)", *options["lease"], options["lease"])
+latest_month = options["latest_month"]
 month_range = st.sidebar.date_input("Month Sold Range",[latest_month - pd.DateOffset(months=12), latest_month])
 
 # -----------------------------
-# Filter Data
+# Filter Data & Derived Columns
 # -----------------------------
-filtered = df[
-    (df["town"].str.upper()==town.upper()) &
-    (df["flat_type"].str.upper()==flat_type.upper()) &
-    (df["flat_model"].isin(selected_flat_models)) &
-    (df["storey_floor"].between(storey_range[0],storey_range[1])) &
-    (df["floor_area_sqm"].between(floor_area_range[0],floor_area_range[1])) &
-    (df["remaining_lease_years"].between(lease_range[0],lease_range[1])) &
-    (df["month"].between(pd.to_datetime(month_range[0]),pd.to_datetime(month_range[1])))
-].copy()
+# _df is left out of the cache key (the loaded data never changes within a process),
+# so widget changes that leave the filter values untouched are a dict lookup.
+@st.cache_data(max_entries=32)
+def build_filtered(_df, _town_index, town, flat_type, models_tuple, storey_range, floor_area_range, lease_range, month_range):
+    sub = _df.iloc[_town_index.get((town.upper(), flat_type.upper()), [])]
+    filtered = sub[
+        (sub["flat_model"].isin(models_tuple)) &
+        (sub["storey_floor"].between(storey_range[0],storey_range[1])) &
+        (sub["floor_area_sqm"].between(floor_area_range[0],floor_area_range[1])) &
+        (sub["remaining_lease_years"].between(lease_range[0],lease_range[1])) &
+        (sub["month"].between(pd.to_datetime(month_range[0]),pd.to_datetime(month_range[1])))
+    ]
 
-# -----------------------------
-# Floor Category & Lease Bucket
-# -----------------------------
-filtered["floor_category"]=pd.cut(filtered["storey_floor"],bins=[-1,9,20,100],labels=["Low (<10)","Mid (10-20)","High (>20)"])
-def lease_bucket(x):
-    if x>=81: return "81-99 yrs"
-    elif x>=61: return "61-80 yrs"
-    else: return "0-60 yrs"
-filtered["lease_bucket"]=filtered["remaining_lease_years"].apply(lease_bucket)
+    # Floor Category & Lease Bucket
+    floor_codes = np.searchsorted([10, 21], filtered["storey_floor"].to_numpy(), side="right")
+    floor_category = pd.Categorical.from_codes(floor_codes, ["Low (<10)","Mid (10-20)","High (>20)"])
+    years = filtered["remaining_lease_years"].to_numpy()
+    lease_codes = np.where(years>=81, 2, np.where(years>=61, 1, 0))
+    lease_bucket = pd.Categorical.from_codes(lease_codes, ["0-60 yrs","61-80 yrs","81-99 yrs"])
+
+    # Floor Area Bins
+    # Right-closed 10 sqm bins, the lowest one also taking the minimum area itself
+    fa = filtered["floor_area_sqm"].to_numpy()
+    if len(fa):
+        lo, hi = int(fa.min()), int(fa.max())
+        # At least two edges, so a selection within one whole sqm still gets a bin
+        edges = np.arange(lo, max(hi, lo + 1) + 10, 10, dtype=np.int16)
+        labels = [f"{edges[i]}-{edges[i+1]}" for i in range(len(edges)-1)]
+        bin_codes = np.clip(np.digitize(fa, edges, right=True) - 1, 0, len(labels) - 1)
+    else:
+        # Empty selection: no bins, so the charts below show their empty/"No data" states
+        labels, bin_codes = [], np.array([], dtype=np.intp)
+    floor_bin_str = pd.Categorical.from_codes(bin_codes, labels)
+
+    # Price in $k for the trend charts
+    price_k = (filtered["resale_price"].to_numpy() / 1000).astype(np.float32)
+
+    # Attach via assign: the boolean slice is already a new frame, no defensive copy needed
+    return filtered.assign(
+        floor_category=floor_category,
+        lease_bucket=lease_bucket,
+        floor_bin_str=floor_bin_str,
+        price_k=price_k
+    )
+
+filtered = build_filtered(
+    df, town_index, town, flat_type, tuple(selected_flat_models),
+    storey_range, floor_area_range, lease_range, tuple(month_range)
+)
 
 # -----------------------------
 # Price Trend Charts by Floor Category & Lease Bucket
 # -----------------------------
 st.subheader("📈 Resale Price Trend by Floor Category and Lease Bucket")
 color_palette = {"0-60 yrs": "#FFA600", "61-80 yrs": "#4ECDC4", "81-99 yrs": "#FF6B6B"}
+webgl_min_rows = 1000  # below this SVG renders just as fast and draws trendlines more cleanly
+trend_cols = ["month","price_k","lease_bucket","resale_price","block","street_name","storey_floor","remaining_lease_years","floor_area_sqm"]
+
+# Figures are cached on the filtered rows (the derived columns follow from them), so
+# widget changes that don't touch the filter reuse the built figures
+def frame_key(df):
+    return (df.shape, df.index.to_numpy().tobytes())
+
+figure_cache = dict(max_entries=32, hash_funcs={pd.DataFrame: frame_key})
+
+@st.cache_data(**figure_cache)
+def make_trend_fig(filtered, cat):
+    df_cat = filtered.loc[filtered["floor_category"]==cat, trend_cols]
+    if df_cat.empty:
+        return None
+    fig = px.scatter(
+        df_cat,
+        x="month",
+        y="price_k",
+        color="lease_bucket",
+        render_mode="webgl" if len(df_cat) > webgl_min_rows else "svg",
+        color_discrete_map=color_palette,
+        labels={"month":"Month Sold","price_k":"Price ($k)","lease_bucket":"Lease Bucket"},
+        hover_data={
+            "resale_price":True,
+            "block":True,
+            "street_name":True,
+            "storey_floor":True,
+            "remaining_lease_years":True,
+            "floor_area_sqm":True,
+            "month":True
+        }
+    )
+    # Linear trend per lease bucket; lines stay SVG since GL draws them poorly
+    for bucket, grp in df_cat.groupby("lease_bucket", observed=True):
+        months = np.unique(grp["month"].to_numpy())
+        if len(months) < 2:
+            continue
+        days = (grp["month"].to_numpy() - months[0]) / np.timedelta64(1, "D")
+        coef = np.polyfit(days, grp["price_k"].to_numpy(), 1)
+        fig.add_trace(go.Scatter(
+            x=months,
+            y=np.polyval(coef, (months - months[0]) / np.timedelta64(1, "D")),
+            mode="lines",
+            line_color=color_palette[bucket],
+            name=bucket,
+            legendgroup=bucket,
+            showlegend=False,
+            hovertemplate="Trend: %{y:.0f}k<extra></extra>"
+        ))
+    fig.update_layout(yaxis_title="Resale Price ($k)", xaxis_title="Month Sold")
+    return fig
 
 for cat in ["High (>20)","Mid (10-20)","Low (<10)"]:
     st.markdown(f"### {cat} Floors")
-    df_cat = filtered[filtered["floor_category"]==cat]
-    if not df_cat.empty:
-        fig = px.scatter(
-            df_cat,
-            x="month",
-            y=df_cat["resale_price"]/1000,
-            color="lease_bucket",
-            trendline="ols",
-            color_discrete_map=color_palette,
-            labels={"month":"Month Sold","resale_price":"Price ($k)","lease_bucket":"Lease Bucket"},
-            hover_data={
-                "resale_price":True,
-                "block":True,
-                "street_name":True,
-                "storey_floor":True,
-                "remaining_lease_years":True,
-                "floor_area_sqm":True,
-                "month":True
-            }
-        )
-        fig.update_layout(yaxis_title="Resale Price ($k)", xaxis_title="Month Sold")
+    fig = make_trend_fig(filtered, cat)
+    if fig is not None:
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No data for this floor category.")
@@ -144,98 +241,117 @@ for cat in ["High (>20)","Mid (10-20)","Low (<10)"]:
 # Box & Violin Plots (Floor Area vs Price)
 # -----------------------------
 st.subheader("📦 Resale Price Distribution by Floor Area")
-floor_bins = range(int(filtered["floor_area_sqm"].min()), int(filtered["floor_area_sqm"].max()) + 10, 10)
-filtered["floor_bin"] = pd.cut(filtered["floor_area_sqm"], bins=floor_bins)
-filtered["floor_bin_str"] = filtered["floor_bin"].astype(str)  # Fix for Interval serialization
-
 # Box Plot
-fig_box = px.box(
-    filtered,
-    x="floor_bin_str",
-    y="resale_price",
-    color="lease_bucket",
-    labels={"floor_bin_str":"Floor Area (sqm)","resale_price":"Resale Price ($k)","lease_bucket":"Lease Bucket"},
-    color_discrete_map=color_palette
-)
-fig_box.update_yaxes(title="Resale Price ($k)")
-st.plotly_chart(fig_box, use_container_width=True)
+@st.cache_data(**figure_cache)
+def make_box_fig(filtered):
+    fig_box = px.box(
+        filtered,
+        x="floor_bin_str",
+        y="resale_price",
+        color="lease_bucket",
+        labels={"floor_bin_str":"Floor Area (sqm)","resale_price":"Resale Price ($k)","lease_bucket":"Lease Bucket"},
+        color_discrete_map=color_palette
+    )
+    fig_box.update_yaxes(title="Resale Price ($k)")
+    return fig_box
+
+st.plotly_chart(make_box_fig(filtered), use_container_width=True)
 
 # Violin Plot
-fig_violin = px.violin(
-    filtered,
-    x="floor_bin_str",
-    y="resale_price",
-    color="lease_bucket",
-    box=True,
-    points="all",
-    labels={"floor_bin_str":"Floor Area (sqm)","resale_price":"Resale Price ($k)","lease_bucket":"Lease Bucket"},
-    color_discrete_map=color_palette
-)
-fig_violin.update_yaxes(title="Resale Price ($k)")
-st.plotly_chart(fig_violin, use_container_width=True)
+@st.cache_data(**figure_cache)
+def make_violin_fig(filtered, show_all_points):
+    fig_violin = px.violin(
+        filtered,
+        x="floor_bin_str",
+        y="resale_price",
+        color="lease_bucket",
+        box=True,
+        points="all" if show_all_points else "outliers",
+        labels={"floor_bin_str":"Floor Area (sqm)","resale_price":"Resale Price ($k)","lease_bucket":"Lease Bucket"},
+        color_discrete_map=color_palette
+    )
+    fig_violin.update_yaxes(title="Resale Price ($k)")
+    return fig_violin
+
+show_all_points = st.checkbox("Show all points")
+st.plotly_chart(make_violin_fig(filtered, show_all_points), use_container_width=True)
 
 # -----------------------------
 # Average Resale Price by Street Name
 # -----------------------------
 st.subheader("🌡️ Average Resale Price by Street Name")
-street_data = filtered.groupby("street_name").agg(
-    avg_price=('resale_price','mean')
-).reset_index()
-street_data["avg_price_k"] = (street_data["avg_price"]/1000).round(0)
-street_data = street_data.sort_values("avg_price_k", ascending=False)
-
-fig_street = px.bar(
-    street_data,
-    x="street_name",
-    y="avg_price_k",
-    text="avg_price_k",
-    labels={"street_name":"Street Name","avg_price_k":"Avg Price ($k)"},
-    color="avg_price_k",
-    color_continuous_scale=px.colors.sequential.Tealgrn
-)
-fig_street.update_layout(
-    xaxis_tickangle=-45,
-    xaxis_title="Street Name",
-    yaxis_title="Average Resale Price ($k)"
-)
-st.plotly_chart(fig_street, use_container_width=True)
+@st.cache_data(**figure_cache)
+def make_street_fig(filtered):
+    avg_price = filtered.groupby("street_name", observed=True, sort=False)["resale_price"].mean()
+    street_data = pd.DataFrame({
+        "street_name": avg_price.index.to_numpy(),
+        "avg_price_k": (avg_price.to_numpy()/1000).round(0)
+    }).sort_values("avg_price_k", ascending=False)
+
+    fig_street = px.bar(
+        street_data,
+        x="street_name",
+        y="avg_price_k",
+        text="avg_price_k",
+        labels={"street_name":"Street Name","avg_price_k":"Avg Price ($k)"},
+        color="avg_price_k",
+        color_continuous_scale=px.colors.sequential.Tealgrn
+    )
+    fig_street.update_layout(
+        xaxis_tickangle=-45,
+        xaxis_title="Street Name",
+        yaxis_title="Average Resale Price ($k)"
+    )
+    return fig_street
+
+st.plotly_chart(make_street_fig(filtered), use_container_width=True)
 
 # -----------------------------
 # Potential Purchase Scoring (Top 20)
 # -----------------------------
+def calculate_value_score(df, median_psqm, median_fa):
+    sf = df["storey_floor"].to_numpy()
+    fa = df["floor_area_sqm"].to_numpy()
+    psqm = df["price_per_sqm"].to_numpy()
+    lease = df["remaining_lease_years"].to_numpy()
+    score = (
+        50
+        + np.where(sf>20, 5, np.where(sf>=10, 3, 0))
+        + np.where(fa>median_fa, 5, 0)
+        + np.where(psqm<median_psqm, 15, -15*((psqm-median_psqm)/median_psqm))
+        - np.where(lease<60, 25, np.where(lease<80, 10, 0))
+    )
+    return np.clip(score, 0, 100)
+
+def explain_score(df, median_psqm, median_fa):
+    sf = df["storey_floor"].to_numpy()
+    reasons = [
+        (sf>20, "High floor"),
+        ((sf>=10) & (sf<=20), "Mid floor"),
+        (df["floor_area_sqm"].to_numpy()>median_fa, "Spacious"),
+        (df["remaining_lease_years"].to_numpy()<60, "Low remaining lease"),
+        (df["price_per_sqm"].to_numpy()<median_psqm, "Good value $/sqm"),
+    ]
+    text = np.full(len(df), "", dtype=object)
+    for mask, reason in reasons:
+        text = np.where(mask, text + reason + ", ", text)
+    return np.char.rstrip(text.astype(str), ", ")
+
+# Medians of the whole selection, computed once and shared by the score and its explanation
 median_psqm = filtered['price_per_sqm'].median()
-def calculate_value_score(row):
-    score = 50
-    if row["storey_floor"]>20: score+=5
-    elif row["storey_floor"]>=10: score+=3
-    if row["floor_area_sqm"]>filtered['floor_area_sqm'].median(): score+=5
-    if row['price_per_sqm']<median_psqm: score+=15
-    else: score-=15*((row['price_per_sqm']-median_psqm)/median_psqm)
-    if row["remaining_lease_years"]<60: score-=25
-    elif row["remaining_lease_years"]<80: score-=10
-    return max(min(score,100),0)
-
-def explain_score(row):
-    reasons=[]
-    if row["storey_floor"]>20: reasons.append("High floor")
-    elif row["storey_floor"]>=10: reasons.append("Mid floor")
-    if row["floor_area_sqm"]>filtered['floor_area_sqm'].median(): reasons.append("Spacious")
-    if row["remaining_lease_years"]<60: reasons.append("Low remaining lease")
-    if row['price_per_sqm']<median_psqm: reasons.append("Good value $/sqm")
-    return ", ".join(reasons)
-
-filtered["Potential Score"] = filtered.apply(calculate_value_score, axis=1)
-filtered["Why Recommended"] = filtered.apply(explain_score, axis=1)
-
-# Top 20 only
-top20 = filtered.sort_values("Potential Score",ascending=False).head(20).copy()
-top20['resale_price'] = top20['resale_price'].apply(lambda x: format_price(x))
+median_fa = filtered['floor_area_sqm'].median()
+scores = calculate_value_score(filtered, median_psqm, median_fa)
 
-# Add Score Bar column
-def score_color(val):
-    if val>=75: return 'background-color: #2ECC71'
-    elif val>=50: return 'background-color: #F1C40F'
-    else: return 'background-color: #E74C3C'
+# Top 20 only: partial selection on the scores, reasons built for those rows alone
+k = min(20, len(scores))
+top_idx = np.argpartition(-scores, k-1)[:k] if k else np.array([], dtype=int)
+top20 = (
+    filtered.iloc[top_idx]
+    .assign(**{"Potential Score": scores[top_idx]})
+    .sort_values("Potential Score",ascending=False)
+)
+top20["Why Recommended"] = explain_score(top20, median_psqm, median_fa)
+top20['resale_price'] = top20['resale_price'].apply(lambda x: format_price(x))
 
 top20_display = top20[[
     "month","town","flat_type","block","street_name","storey_range","floor_area_sqm",
@@ -259,6 +375,11 @@ top20_display.rename(columns={
 
 st.subheader("💡 Top 20 Potential Purchase Flats")
 st.dataframe(
-    top20_display.style.bar(subset=["Potential Score"], color=['#E74C3C','#2ECC71']),
+    top20_display,
+    column_config={
+        # Score bar drawn by the frontend instead of Styler-generated HTML
+        "Potential Score": st.column_config.ProgressColumn("Potential Score", min_value=0, max_value=100, format="%d")
+    },
+    hide_index=True,
     height=600
 )